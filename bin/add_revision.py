@@ -36,6 +36,7 @@ When you are ready, add `--do`.
 """
 
 import argparse
+import fcntl
 import filetype
 import os
 import shutil
@@ -47,7 +48,9 @@ from anthology.utils import (
     deconstruct_anthology_id,
     make_simple_element,
     indent,
-    compute_hash,
+    compute_hash_from_stream,
+    format_hash,
+    update_hash,
     infer_url,
     is_newstyle_id,
 )
@@ -58,10 +61,20 @@ import urllib.request
 
 from datetime import datetime
 
+# Read size for streaming downloads
+CHUNK_SIZE = 131072
 
-def validate_file_type(path):
-    """Ensure downloaded file mime type matches its extension (e.g., PDF)"""
-    detected = filetype.guess(path)
+# ioctl request for copy-on-write clones (Linux, from <linux/fs.h>)
+FICLONE = 0x40049409
+
+
+def validate_file_type(path, header=None):
+    """Ensure downloaded file mime type matches its extension (e.g., PDF).
+
+    If the leading bytes of the file are already in memory, pass them as
+    `header` to avoid re-reading the file from disk.
+    """
+    detected = filetype.guess(path if header is None else header)
     if detected is None or not detected.mime.endswith(detected.extension):
         mime_type = 'UNKNOWN' if detected is None else detected.mime
         print(
@@ -72,12 +85,23 @@ def validate_file_type(path):
 
 
 def download_file(source, dest):
+    """Downloads source to dest in a single streaming pass.
+
+    Returns the checksum of the downloaded file and its first chunk, which
+    can be passed to validate_file_type().
+    """
+    checksum = 0
+    header = b""
     try:
         print(
             f"-> Downloading file from {source} to {dest}", file=sys.stderr,
         )
         with urllib.request.urlopen(source) as url, open(dest, mode="wb") as fh:
-            fh.write(url.read())
+            for chunk in iter(lambda: url.read(CHUNK_SIZE), b""):
+                fh.write(chunk)
+                checksum = update_hash(chunk, checksum)
+                if not header:
+                    header = chunk
     except ssl.SSLError:
         print(
             f"-> FATAL: An SSL error was encountered in downloading {source}.",
@@ -85,12 +109,49 @@ def download_file(source, dest):
         )
         sys.exit(1)
 
+    return format_hash(checksum), header
+
+
+def reflink(file_from, file_to):
+    """Creates file_to as a copy-on-write clone of file_from.
+    Raises OSError if the filesystem does not support it."""
+    with open(file_from, "rb") as src, open(file_to, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.remove(file_to)
+            raise
+
+
+def clone_file(file_from, file_to, link=False):
+    """Copies file_from to file_to, sharing storage on disk where possible.
+
+    A reflink is tried first; if `link` is set, a hardlink is tried next,
+    before falling back to a regular copy. The result is moved into place
+    with os.replace(), so an existing file_to is never overwritten in place
+    (it may share its inode with another version of the paper).
+    """
+    tmp_path = f"{file_to}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    for method in (reflink, os.link) if link else (reflink,):
+        try:
+            method(file_from, tmp_path)
+            break
+        except OSError:
+            pass
+    else:
+        shutil.copy(file_from, tmp_path)
+
+    os.replace(tmp_path, file_to)
+
 
 def main(args):
-    def maybe_copy(file_from, file_to):
+    def maybe_copy(file_from, file_to, link=False):
         if not args.dry_run:
             print("-> Copying from {} -> {}".format(file_from, file_to), file=sys.stderr)
-            shutil.copy(file_from, file_to)
+            clone_file(file_from, file_to, link=link)
             os.chmod(file_to, 0o644)
         else:
             print(
@@ -106,11 +167,14 @@ def main(args):
     # TODO: make sure path exists, or download URL to temp file
     if args.path.startswith("http"):
         _, input_file_path = tempfile.mkstemp()
-        download_file(args.path, input_file_path)
+        checksum, header = download_file(args.path, input_file_path)
+        validate_file_type(input_file_path, header)
     else:
         input_file_path = args.path
-
-    validate_file_type(input_file_path)
+        with open(input_file_path, "rb") as f:
+            validate_file_type(input_file_path, f.read(CHUNK_SIZE))
+            f.seek(0)
+            checksum = compute_hash_from_stream(f)
 
     collection_id, volume_id, paper_id = deconstruct_anthology_id(args.anthology_id)
     venue_name = collection_id.split(".")[1]
@@ -119,9 +183,6 @@ def main(args):
     # The new version
     revno = None
 
-    with open(input_file_path, "rb") as f:
-        checksum = compute_hash(f.read())
-
     # Files for old-style IDs are stored under anthology-files/pdf/P/P19/*
     # Files for new-style IDs are stored under anthology-files/pdf/2020.acl/*
     if is_newstyle_id(args.anthology_id):
@@ -153,25 +214,44 @@ def main(args):
         if not args.dry_run:
             # Update the URL hash on the <url> tag
             url = paper.find("./url")
+            url_checksum = None
             if url is not None:
+                url_checksum = url.attrib.get("hash")
                 url.attrib["hash"] = checksum
 
             if not args.erratum and revno == 2:
-                if paper.find("./url") is not None:
-                    current_version_url = infer_url(paper.find("./url").text) + ".pdf"
+                if url is not None:
+                    current_version_url = infer_url(url.text) + ".pdf"
 
-                # Download original file
                 # There are no versioned files the first time around, so create the first one
                 # (essentially backing up the original version)
                 revised_file_v1_path = os.path.join(
                     output_dir, f"{args.anthology_id}{change_letter}1.pdf"
                 )
 
-                download_file(current_version_url, revised_file_v1_path)
-                validate_file_type(revised_file_v1_path)
-
-                with open(revised_file_v1_path, "rb") as f:
-                    old_checksum = compute_hash(f.read())
+                if os.path.exists(canonical_path):
+                    # The original is already on disk; archive it instead of
+                    # downloading it again
+                    maybe_copy(canonical_path, revised_file_v1_path, link=True)
+                    with open(revised_file_v1_path, "rb") as f:
+                        validate_file_type(revised_file_v1_path, f.read(CHUNK_SIZE))
+                        f.seek(0)
+                        old_checksum = compute_hash_from_stream(f)
+                else:
+                    # Download original file
+                    old_checksum, header = download_file(
+                        current_version_url, revised_file_v1_path
+                    )
+                    validate_file_type(revised_file_v1_path, header)
+
+                # The <url> hash is not authoritative (e.g., errata overwrite it),
+                # so it is only used as a sanity check
+                if url_checksum and url_checksum != old_checksum:
+                    print(
+                        f"-> WARNING: {revised_file_v1_path} has hash {old_checksum}, "
+                        f"but the XML recorded {url_checksum}",
+                        file=sys.stderr,
+                    )
 
                 # First revision requires making the original version explicit
                 revision = make_simple_element(
@@ -196,9 +276,18 @@ def main(args):
                 },
                 parent=paper,
             )
-            indent(tree.getroot())
 
-            tree.write(xml_file, encoding="UTF-8", xml_declaration=True)
+            # Only the paper changed, so only re-indent that subtree
+            tail = paper.tail
+            indent(paper, level=2)
+            paper.tail = tail
+            tree.getroot().tail = "\n"
+
+            # Write to a temporary file and move it into place, so that a failure
+            # part-way through cannot leave a truncated collection file behind
+            tmp_xml_file = f"{xml_file}.tmp"
+            tree.write(tmp_xml_file, encoding="UTF-8", xml_declaration=True)
+            os.replace(tmp_xml_file, xml_file)
             print(
                 f'-> Added {change_type} node "{revision.text}" to XML', file=sys.stderr
             )
@@ -217,9 +306,10 @@ def main(args):
     # Copy the file to the versioned path
     maybe_copy(input_file_path, revised_file_versioned_path)
 
-    # Copy it over the canonical path
+    # Copy it over the canonical path. Both live in output_dir, so this can
+    # usually be a hardlink to the versioned file.
     if not args.erratum:
-        maybe_copy(input_file_path, canonical_path)
+        maybe_copy(revised_file_versioned_path, canonical_path, link=True)
 
     if args.path.startswith("http"):
         os.remove(input_file_path)
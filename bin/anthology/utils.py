@@ -20,6 +20,7 @@ import os
 import re
 import requests
 
+from functools import lru_cache
 from lxml import etree
 from urllib.parse import urlparse
 from xml.sax.saxutils import escape as xml_escape
@@ -143,6 +144,7 @@ def retrieve_url(remote_url: str, local_path: str):
             input_file_fh.write(url.read())
 
 
+@lru_cache(maxsize=1024)
 def deconstruct_anthology_id(anthology_id: str) -> Tuple[str, str, str]:
     """
     Transforms an Anthology ID into its constituent collection id, volume id, and paper id
@@ -216,6 +218,7 @@ def remove_extra_whitespace(text):
     return re.sub(" +", " ", text.replace("\n", "").strip())
 
 
+@lru_cache(maxsize=1024)
 def infer_url(filename, prefix=data.ANTHOLOGY_PREFIX):
     """If URL is relative, return the full Anthology URL.
     """
@@ -433,11 +436,38 @@ def make_simple_element(tag, text=None, attrib=None, parent=None, namespaces=Non
     return el
 
 
+def update_hash(value: bytes, checksum: int = 0) -> int:
+    """Extends a running checksum with the next chunk of data.
+    Start from 0 and pass the result to format_hash() when done."""
+    return crc32(value, checksum)
+
+
+def format_hash(checksum: int) -> str:
+    return f"{checksum & 0xFFFFFFFF:08x}"
+
+
 def compute_hash(value: bytes) -> str:
-    checksum = crc32(value) & 0xFFFFFFFF
-    return f"{checksum:08x}"
+    return format_hash(update_hash(value))
+
+
+def compute_hash_from_stream(fh, bufsize: int = 131072) -> str:
+    """Computes the checksum of a binary file object, reading it in chunks
+    so that the whole file never has to be held in memory.
+
+    Chunks are read into a single reused buffer (as hashlib.file_digest()
+    does) rather than allocating a new bytes object for each read.
+    """
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    checksum = 0
+    while True:
+        size = fh.readinto(buf)
+        if not size:
+            break
+        checksum = update_hash(view[:size], checksum)
+    return format_hash(checksum)
 
 
 def compute_hash_from_file(path: str) -> str:
     with open(path, "rb") as f:
-        return compute_hash(f.read())
+        return compute_hash_from_stream(f)